@@ -4,11 +4,30 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from celery import Celery
-from database import save_analysis, update_analysis
+from kombu import Queue
+from database import save_analysis, update_analysis, get_analysis
+from lifecycle import LIFECYCLE_RUNNER
 
 # Redis URL for Celery broker and backend
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
+# Size-aware routing: documents up to this many pages go to the interactive queue
+BULK_PAGE_THRESHOLD = int(os.getenv("BULK_PAGE_THRESHOLD", "20"))
+
+INTERACTIVE_QUEUE = "interactive"
+BULK_QUEUE = "bulk"
+
+# Worker processes per queue, applied by `python celery_worker.py <queue>`.
+# Also used to spread the queue backlog when estimating wait times.
+QUEUE_CONCURRENCY = {
+    INTERACTIVE_QUEUE: int(os.getenv("INTERACTIVE_CONCURRENCY", "4")),
+    BULK_QUEUE: int(os.getenv("BULK_CONCURRENCY", "1")),
+}
+
+# Message priorities (Redis transport: 0 is highest, 9 is lowest)
+MAX_PRIORITY = 9
+DEFAULT_PRIORITY = MAX_PRIORITY // 2
+
 # Create Celery app
 celery_app = Celery(
     "financial_analyzer",
@@ -25,12 +44,62 @@ celery_app.conf.update(
     task_track_started=True,
     task_acks_late=True,
     worker_prefetch_multiplier=1,  # Process one task at a time per worker
+    task_queues=(
+        Queue(INTERACTIVE_QUEUE),
+        Queue(BULK_QUEUE),
+    ),
+    task_default_queue=INTERACTIVE_QUEUE,
+    task_default_priority=DEFAULT_PRIORITY,
+    broker_transport_options={
+        "priority_steps": list(range(MAX_PRIORITY + 1)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+    },
+    # Periodic storage lifecycle maintenance when LIFECYCLE_RUNNER=celery (requires `celery ... beat`).
+    # It is cheap, so it goes to the interactive queue rather than waiting behind bulk backfills.
+    beat_schedule={
+        "storage-lifecycle": {
+            "task": "run_storage_lifecycle",
+            "schedule": float(os.getenv("LIFECYCLE_INTERVAL_SECONDS", "3600")),
+            "options": {"queue": INTERACTIVE_QUEUE, "priority": DEFAULT_PRIORITY},
+        },
+    } if LIFECYCLE_RUNNER == "celery" else {},
 )
 
 
+def route_for_document(page_count: int, bulk: bool = False):
+    """Pick the queue and message priority for a document based on its page count.
+
+    Small documents go to the interactive queue and large documents (or explicit
+    backfills) to the bulk queue. Within a queue, shorter documents get higher priority.
+    A page count of 0 means the PDF could not be parsed, so its real size is unknown:
+    it goes to the bulk queue at the default priority.
+    """
+    if not page_count and not bulk:
+        return BULK_QUEUE, DEFAULT_PRIORITY
+    if bulk or page_count > BULK_PAGE_THRESHOLD:
+        queue = BULK_QUEUE
+        # Bulk priorities span the full range; backfills always run last
+        priority = MAX_PRIORITY if bulk else min(MAX_PRIORITY, page_count // max(1, BULK_PAGE_THRESHOLD))
+    else:
+        queue = INTERACTIVE_QUEUE
+        priority = min(MAX_PRIORITY, page_count * MAX_PRIORITY // max(1, BULK_PAGE_THRESHOLD))
+    return queue, priority
+
+
 @celery_app.task(bind=True, name="analyze_document_async")
 def analyze_document_async(self, task_id: str, query: str, file_path: str, filename: str):
     """Async task to analyze a financial document using the CrewAI crew."""
+    # The lifecycle manager may have given up on this task (and removed its upload) while
+    # the message was still queued; don't resurrect it
+    analysis = get_analysis(task_id)
+    if analysis is None or analysis.status == "failed":
+        return {
+            "task_id": task_id,
+            "status": "skipped",
+            "error": "Task was abandoned before a worker picked it up",
+        }
+
     try:
         # Update status to processing
         update_analysis(task_id=task_id, status="processing")
@@ -39,10 +108,10 @@ def analyze_document_async(self, task_id: str, query: str, file_path: str, filen
         from main import run_crew
 
         # Run the CrewAI analysis
-        result = run_crew(query=query, file_path=file_path)
+        result, token_stats = run_crew(query=query, file_path=file_path)
 
         # Save result to database
-        update_analysis(task_id=task_id, result=str(result), status="completed")
+        update_analysis(task_id=task_id, result=str(result), status="completed", token_stats=token_stats)
 
         # Clean up uploaded file
         if os.path.exists(file_path):
@@ -56,6 +125,7 @@ def analyze_document_async(self, task_id: str, query: str, file_path: str, filen
             "status": "completed",
             "result": str(result),
             "file_processed": filename,
+            "tokens_saved": token_stats["tokens_saved"],
         }
 
     except Exception as e:
@@ -74,3 +144,26 @@ def analyze_document_async(self, task_id: str, query: str, file_path: str, filen
             "status": "failed",
             "error": str(e),
         }
+
+
+@celery_app.task(name="run_storage_lifecycle")
+def run_storage_lifecycle():
+    """Periodic task: reconcile uploads, expire old analyses and compact the database."""
+    from lifecycle import run_lifecycle_cycle
+    return run_lifecycle_cycle()
+
+
+if __name__ == "__main__":
+    # Start a worker for one queue with its configured concurrency, e.g. `python celery_worker.py bulk`
+    import sys
+
+    queue = sys.argv[1] if len(sys.argv) > 1 else INTERACTIVE_QUEUE
+    if queue not in QUEUE_CONCURRENCY:
+        sys.exit(f"Unknown queue '{queue}', expected one of: {', '.join(QUEUE_CONCURRENCY)}")
+    celery_app.worker_main([
+        "worker",
+        "-Q", queue,
+        "-c", str(QUEUE_CONCURRENCY[queue]),
+        "-n", f"{queue}@%h",
+        "--loglevel=info",
+    ])
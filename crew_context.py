@@ -0,0 +1,232 @@
+"""Prompt-token budgeting and context compaction for the sequential CrewAI pipeline.
+
+In a sequential crew every task receives the raw outputs of all earlier tasks as
+context, and agents re-read the same document with the Financial Document Reader.
+A CrewContextManager is activated for one crew run and:
+
+- counts (approximate) tokens per stage alongside CrewAI's measured usage,
+- swaps each intermediate task output for a compact structured summary while later
+  tasks run, so the context they receive stays within CONTEXT_TOKEN_BUDGET (the full
+  outputs are put back when the run ends),
+- stops the reader tool from re-sending document text an agent already has,
+- records how many prompt tokens were saved.
+"""
+import os
+from contextvars import ContextVar
+
+# Total tokens of prior-task output that later tasks may receive as context
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Model used for token counting (matches the LLM configured in agents.py)
+TOKEN_COUNT_MODEL = "gemini/gemini-2.5-flash"
+
+# Divider CrewAI puts between prior task outputs when building a task's context
+CONTEXT_DIVIDER = "\n\n----------\n\n"
+
+_active_context = ContextVar("active_crew_context", default=None)
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text, falling back to ~4 characters per token if LiteLLM is unavailable."""
+    if not text:
+        return 0
+    try:
+        import litellm
+        return litellm.token_counter(model=TOKEN_COUNT_MODEL, text=text)
+    except Exception:
+        return max(1, len(text) // 4)
+
+
+def _line_priority(line: str) -> int:
+    """Rank a line of task output by how much information it carries (lower is kept first)."""
+    if line.startswith("#") or (line.startswith("**") and line.endswith("**")):
+        return 0  # Section headings keep the summary structured
+    has_figure = any(ch.isdigit() for ch in line)
+    is_bullet = line[:2] in ("- ", "* ", "• ") or (line[:1].isdigit() and "." in line[:4])
+    if has_figure and is_bullet:
+        return 1
+    if has_figure:
+        return 2
+    if is_bullet:
+        return 3
+    return 4
+
+
+def summarize_output(text: str, max_tokens: int, label: str = "") -> str:
+    """Extract a compact structured summary of a task output that fits in max_tokens.
+
+    Headings and bullet points carrying figures are kept first; the selected lines
+    are emitted in their original order so the summary still reads top to bottom.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    header = f"[Compact summary of {label} output]" if label else "[Compact summary]"
+    remaining = max_tokens - count_tokens(header)
+
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and line not in lines:
+            lines.append(line[:300])
+
+    # Greedy pick by per-line cost, most informative lines first
+    ranked = sorted(range(len(lines)), key=lambda i: (_line_priority(lines[i]), i))
+    selected = []
+    for index in ranked:
+        line_tokens = count_tokens(lines[index])
+        if line_tokens <= remaining:
+            selected.append(index)
+            remaining -= line_tokens
+
+    # Per-line costs ignore the joining newlines and tokenizer rounding, so measure the
+    # joined summary and drop the least informative lines until it really fits
+    def render(indices):
+        return "\n".join([header] + [lines[i] for i in sorted(indices)])
+
+    summary = render(selected)
+    while selected and count_tokens(summary) > max_tokens:
+        selected.pop()
+        summary = render(selected)
+    while summary and count_tokens(summary) > max_tokens:
+        summary = summary[:-1]  # Budget smaller than the header itself
+    return summary
+
+
+class CrewContextManager:
+    """Tracks prompt tokens and compacts inter-task context for a single crew run."""
+
+    def __init__(self, stage_names, token_budget: int = CONTEXT_TOKEN_BUDGET):
+        self.stage_names = list(stage_names)
+        self.token_budget = token_budget
+        self.current_stage = 0
+        self.stages = []
+        self.tokens_saved = 0
+        self._documents = {}  # file_path -> extracted text, shared by all stages of the run
+        self._stage_reads = set()  # file paths already delivered in the current stage
+        self._stage_document_tokens = 0
+        self._stage_document_tokens_avoided = 0
+        self._context_tokens = 0  # tokens of the context the next stage receives
+        self._compacted = []  # (TaskOutput, full text) pairs to restore when the run ends
+        self._token = None
+
+    def __enter__(self):
+        self._token = _active_context.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active_context.reset(self._token)
+        self.restore_outputs()
+        return False
+
+    @property
+    def per_output_budget(self) -> int:
+        """Token budget for each compacted output, leaving room for the dividers between them."""
+        prior_outputs = max(1, len(self.stage_names) - 1)
+        divider_tokens = count_tokens(CONTEXT_DIVIDER) * (prior_outputs - 1)
+        return max(0, (self.token_budget - divider_tokens) // prior_outputs)
+
+    def restore_outputs(self) -> None:
+        """Put the full text back on compacted task outputs (CrewOutput.tasks_output shares them)."""
+        for output, full_text in self._compacted:
+            output.raw = full_text
+        self._compacted = []
+
+    @property
+    def stage_name(self) -> str:
+        if self.current_stage < len(self.stage_names):
+            return self.stage_names[self.current_stage]
+        return f"stage_{self.current_stage + 1}"
+
+    def cached_document(self, file_path: str):
+        """Return document text already extracted during this run, or None."""
+        return self._documents.get(file_path)
+
+    def deliver_document(self, file_path: str, text: str) -> str:
+        """Return what the reader tool should send to the agent for this document.
+
+        The first read in a stage gets the full text; repeat reads in the same stage
+        (the agent already has it in its conversation) get a short pointer instead.
+        """
+        self._documents[file_path] = text
+        doc_tokens = count_tokens(text)
+        if file_path in self._stage_reads:
+            self._stage_document_tokens_avoided += doc_tokens
+            self.tokens_saved += doc_tokens
+            return (
+                "The full text of this document was already provided earlier in this task. "
+                "Refer to it above instead of reading it again."
+            )
+        self._stage_reads.add(file_path)
+        self._stage_document_tokens += doc_tokens
+        return text
+
+    def on_task_complete(self, output) -> None:
+        """Record token counts for the finished stage and compact its output for later stages."""
+        later_stages = len(self.stage_names) - self.current_stage - 1
+        full_text = output.raw or ""
+        output_tokens = count_tokens(full_text)
+        compact_tokens = output_tokens
+
+        if later_stages > 0:
+            # Later tasks receive every earlier output, so split the budget between them.
+            # CrewAI builds their context from output.raw; the full text is restored on exit.
+            compact = summarize_output(full_text, self.per_output_budget, label=self.stage_name)
+            compact_tokens = count_tokens(compact)
+            self._compacted.append((output, full_text))
+            output.raw = compact
+            self.tokens_saved += (output_tokens - compact_tokens) * later_stages
+
+        self.stages.append({
+            "stage": self.stage_name,
+            "agent": getattr(output, "agent", None),
+            "description_tokens": count_tokens(getattr(output, "description", "")),
+            "context_tokens": self._context_tokens,
+            "document_tokens": self._stage_document_tokens,
+            "document_tokens_avoided": self._stage_document_tokens_avoided,
+            "output_tokens": output_tokens,
+            "compacted_output_tokens": compact_tokens,
+        })
+
+        self._context_tokens += compact_tokens + (count_tokens(CONTEXT_DIVIDER) if self.current_stage else 0)
+        self.current_stage += 1
+        self._stage_reads = set()
+        self._stage_document_tokens = 0
+        self._stage_document_tokens_avoided = 0
+
+    def stats(self, token_usage=None) -> dict:
+        """Per-run token statistics, suitable for storing alongside the analysis.
+
+        `estimated_context_tokens` only covers what this manager controls (task
+        descriptions, prior-task context and document reads). Agent system prompts and
+        the conversation CrewAI re-sends on every ReAct iteration are not included; pass
+        the crew's measured `token_usage` (CrewOutput.token_usage) to record real totals.
+        """
+        stats = {
+            "token_budget": self.token_budget,
+            "estimated_context_tokens": sum(
+                s["description_tokens"] + s["context_tokens"] + s["document_tokens"] for s in self.stages
+            ),
+            "tokens_saved": self.tokens_saved,
+            "stages": self.stages,
+        }
+        if token_usage is not None:
+            stats["measured_prompt_tokens"] = token_usage.prompt_tokens
+            stats["measured_completion_tokens"] = token_usage.completion_tokens
+        return stats
+
+
+def get_active_context():
+    """Return the CrewContextManager for the crew run in progress, if any."""
+    return _active_context.get()
+
+
+def on_task_complete(output) -> None:
+    """Crew task_callback that forwards to the active CrewContextManager.
+
+    Crew copies task_callback onto the (module-level) tasks the first time it runs,
+    so this dispatcher is registered instead of a per-run bound method.
+    """
+    context = get_active_context()
+    if context is not None:
+        context.on_task_complete(output)
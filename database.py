@@ -1,12 +1,29 @@
 """Database module for storing financial analysis results."""
 import os
+import json
 from datetime import datetime
-from sqlalchemy import create_engine, Column, String, Text, DateTime, Integer
+from sqlalchemy import (
+    create_engine, event, inspect, text, func, and_, or_, Column, String, Text, DateTime, Integer, Index,
+)
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./financial_analyzer.db")
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if IS_SQLITE else {})
+
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL lets readers run during lifecycle writes; incremental auto_vacuum only applies to new files."""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -22,14 +39,39 @@ class AnalysisResult(Base):
     result = Column(Text, nullable=True)
     status = Column(String(20), default="pending")  # pending, processing, completed, failed
     error = Column(Text, nullable=True)
+    page_count = Column(Integer, nullable=True)
+    queue = Column(String(20), nullable=True)  # interactive, bulk (None for sync requests)
+    priority = Column(Integer, nullable=True)  # Celery message priority, 0 is highest
+    tokens_saved = Column(Integer, nullable=True)
+    token_stats = Column(Text, nullable=True)  # JSON per-stage token counts from CrewContextManager
     created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
     completed_at = Column(DateTime, nullable=True)
 
+    __table_args__ = (
+        # Queue backlog lookups for wait estimates on /status
+        Index("ix_analysis_results_queue_status_created", "queue", "status", "created_at"),
+    )
+
 
 def init_db():
-    """Create database tables if they don't exist."""
+    """Create database tables if they don't exist and add any newly introduced columns and indexes."""
     Base.metadata.create_all(bind=engine)
 
+    # create_all() never alters existing tables, so add missing nullable columns by hand
+    existing = {col["name"] for col in inspect(engine).get_columns(AnalysisResult.__tablename__)}
+    with engine.begin() as conn:
+        for column in AnalysisResult.__table__.columns:
+            if column.name not in existing:
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(
+                    f"ALTER TABLE {AnalysisResult.__tablename__} ADD COLUMN {column.name} {col_type}"
+                ))
+
+    # Likewise, indexes are only created together with a new table
+    for index in AnalysisResult.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
 
 def get_db():
     """Get database session."""
@@ -41,7 +83,9 @@ def get_db():
 
 
 def save_analysis(task_id: str, filename: str, query: str, result: str = None,
-                  status: str = "completed", error: str = None):
+                  status: str = "completed", error: str = None,
+                  page_count: int = None, queue: str = None, priority: int = None,
+                  token_stats: dict = None):
     """Save an analysis result to the database."""
     db = SessionLocal()
     try:
@@ -52,6 +96,12 @@ def save_analysis(task_id: str, filename: str, query: str, result: str = None,
             result=result,
             status=status,
             error=error,
+            page_count=page_count,
+            queue=queue,
+            priority=priority,
+            tokens_saved=token_stats["tokens_saved"] if token_stats else None,
+            token_stats=json.dumps(token_stats) if token_stats else None,
+            started_at=datetime.utcnow() if status == "processing" else None,
             completed_at=datetime.utcnow() if status in ("completed", "failed") else None,
         )
         db.add(analysis)
@@ -62,7 +112,8 @@ def save_analysis(task_id: str, filename: str, query: str, result: str = None,
         db.close()
 
 
-def update_analysis(task_id: str, result: str = None, status: str = "completed", error: str = None):
+def update_analysis(task_id: str, result: str = None, status: str = "completed", error: str = None,
+                    token_stats: dict = None):
     """Update an existing analysis result."""
     db = SessionLocal()
     try:
@@ -73,6 +124,11 @@ def update_analysis(task_id: str, result: str = None, status: str = "completed",
             analysis.status = status
             if error is not None:
                 analysis.error = error
+            if token_stats is not None:
+                analysis.tokens_saved = token_stats["tokens_saved"]
+                analysis.token_stats = json.dumps(token_stats)
+            if status == "processing":
+                analysis.started_at = datetime.utcnow()
             if status in ("completed", "failed"):
                 analysis.completed_at = datetime.utcnow()
             db.commit()
@@ -100,3 +156,183 @@ def get_all_analyses(limit: int = 50, offset: int = 0):
         ).offset(offset).limit(limit).all()
     finally:
         db.close()
+
+
+# Wait-time model: a crew run costs about the same however long the PDF is, because
+# read_data_tool truncates every document to the same 8000 characters. Estimates are
+# therefore based on average seconds per task (per queue) and the number of tasks
+# ahead, not on page counts; page counts only decide routing.
+
+
+def get_seconds_per_task(queue: str = None, sample_size: int = 50):
+    """Average processing time of the most recent completed tasks, preferring the given queue.
+
+    Falls back to recent tasks from any queue when the queue has no history yet.
+    Returns None until at least one timed task has completed.
+    """
+    db = SessionLocal()
+    try:
+        timed = db.query(AnalysisResult.started_at, AnalysisResult.completed_at).filter(
+            AnalysisResult.status == "completed",
+            AnalysisResult.started_at.isnot(None),
+            AnalysisResult.completed_at.isnot(None),
+        )
+        recent = []
+        if queue is not None:
+            recent = timed.filter(AnalysisResult.queue == queue).order_by(
+                AnalysisResult.completed_at.desc()
+            ).limit(sample_size).all()
+        if not recent:
+            recent = timed.order_by(AnalysisResult.completed_at.desc()).limit(sample_size).all()
+        if not recent:
+            return None
+        return sum((a.completed_at - a.started_at).total_seconds() for a in recent) / len(recent)
+    finally:
+        db.close()
+
+
+def get_queue_backlog_tasks(queue: str, created_at: datetime, priority: int):
+    """Number of tasks in a queue that will be worked on before a pending task with the given priority.
+
+    That is every task already processing, plus pending tasks that the broker hands out
+    first: earlier ones with the same or a higher priority, and later ones with a
+    strictly higher priority (lower number).
+    """
+    db = SessionLocal()
+    try:
+        return db.query(func.count(AnalysisResult.id)).filter(
+            AnalysisResult.queue == queue,
+            AnalysisResult.status.in_(("pending", "processing")),
+            or_(
+                AnalysisResult.status == "processing",
+                and_(AnalysisResult.created_at < created_at, AnalysisResult.priority <= priority),
+                and_(AnalysisResult.created_at >= created_at, AnalysisResult.priority < priority),
+            ),
+        ).scalar()
+    finally:
+        db.close()
+
+
+def estimate_wait_seconds(analysis, concurrency: int = 1):
+    """Estimate seconds until a queued/running task completes, from observed per-task throughput.
+
+    Returns None when there is not enough history (or priority information) to make an estimate.
+    """
+    if analysis.status not in ("pending", "processing"):
+        return None
+
+    seconds_per_task = get_seconds_per_task(analysis.queue)
+    if seconds_per_task is None:
+        return None
+
+    if analysis.status == "processing":
+        elapsed = (datetime.utcnow() - analysis.started_at).total_seconds() if analysis.started_at else 0
+        return max(0, round(seconds_per_task - elapsed))
+
+    if analysis.priority is None:
+        return None
+
+    # Tasks ahead of us are shared across the queue's worker processes; running ones are
+    # counted as a whole task since how far along they are isn't tracked
+    backlog_tasks = get_queue_backlog_tasks(analysis.queue, analysis.created_at, analysis.priority)
+    ahead_seconds = backlog_tasks * seconds_per_task / max(1, concurrency)
+    return round(ahead_seconds + seconds_per_task)
+
+
+def get_statuses(task_ids):
+    """Map task_id -> (status, created_at) for the given task IDs that exist in the database."""
+    db = SessionLocal()
+    try:
+        rows = db.query(
+            AnalysisResult.task_id, AnalysisResult.status, AnalysisResult.created_at
+        ).filter(AnalysisResult.task_id.in_(list(task_ids))).all()
+        return {row.task_id: (row.status, row.created_at) for row in rows}
+    finally:
+        db.close()
+
+
+def delete_expired_analyses(cutoff: datetime, batch_size: int = 500):
+    """Delete one batch of finished analyses created before cutoff; returns the deleted task IDs.
+
+    Each call is a single short transaction so live requests are never blocked for long.
+    """
+    db = SessionLocal()
+    try:
+        expired = db.query(AnalysisResult.id, AnalysisResult.task_id).filter(
+            AnalysisResult.created_at < cutoff,
+            AnalysisResult.status.in_(("completed", "failed")),
+        ).order_by(AnalysisResult.id).limit(batch_size).all()
+        if not expired:
+            return []
+
+        db.query(AnalysisResult).filter(
+            AnalysisResult.id.in_([row.id for row in expired])
+        ).delete(synchronize_session=False)
+        db.commit()
+        return [row.task_id for row in expired]
+    finally:
+        db.close()
+
+
+def fail_stale_analyses(cutoff: datetime, pending_cutoff: datetime, batch_size: int = 500):
+    """Mark one batch of abandoned analyses as failed.
+
+    Rows processing since before cutoff belong to a worker or API process that died
+    (rows from before started_at existed fall back to created_at). Rows still pending
+    since before pending_cutoff, which should be much older, were never picked up
+    because their message was lost or never queued. Returns the task IDs that were updated.
+    """
+    db = SessionLocal()
+    try:
+        stale = db.query(AnalysisResult).filter(
+            or_(
+                and_(
+                    AnalysisResult.status == "processing",
+                    func.coalesce(AnalysisResult.started_at, AnalysisResult.created_at) < cutoff,
+                ),
+                and_(AnalysisResult.status == "pending", AnalysisResult.created_at < pending_cutoff),
+            ),
+        ).order_by(AnalysisResult.id).limit(batch_size).all()
+        now = datetime.utcnow()
+        for analysis in stale:
+            analysis.status = "failed"
+            analysis.error = "Abandoned: the process handling this task exited before it completed"
+            analysis.completed_at = now
+        db.commit()
+        return [analysis.task_id for analysis in stale]
+    finally:
+        db.close()
+
+
+def incremental_vacuum(pages: int = 200):
+    """Release up to `pages` free pages back to the filesystem (SQLite only).
+
+    Returns the number of free pages left, or None when the database is not SQLite
+    or was created before incremental auto_vacuum was enabled (needs a one-off VACUUM).
+    """
+    if not IS_SQLITE:
+        return None
+    raw = engine.raw_connection()
+    try:
+        sqlite_conn = raw.driver_connection
+        if sqlite_conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # 2 == INCREMENTAL
+            return None
+        # The pragma frees one page per statement step. A normal cursor execute() stops after
+        # the first step (the pragma returns no columns), while executescript() runs it to
+        # completion.
+        sqlite_conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        return sqlite_conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        raw.close()
+
+
+def analyze_db(analysis_limit: int = 1000):
+    """Refresh query planner statistics for the analysis table.
+
+    On SQLite, analysis_limit caps the rows sampled per index so the cost (and the time
+    the lock is held) stays bounded however large the table grows.
+    """
+    with engine.begin() as conn:
+        if IS_SQLITE:
+            conn.execute(text(f"PRAGMA analysis_limit={int(analysis_limit)}"))
+        conn.execute(text(f"ANALYZE {AnalysisResult.__tablename__}"))
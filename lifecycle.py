@@ -0,0 +1,176 @@
+"""Storage lifecycle manager for uploaded PDFs and analysis history.
+
+Uploads are normally removed by the request/worker that processed them, but crashed
+workers and killed servers leave orphans behind, and analysis_results grows forever.
+A maintenance cycle:
+
+1. marks tasks whose process died long ago as failed,
+2. reconciles data/ against the database and removes orphaned upload files,
+3. expires finished rows (and any leftover files) past the retention period,
+4. runs an incremental VACUUM and ANALYZE on SQLite.
+
+All database work happens in small batches, each in its own short transaction with
+a pause in between, so live requests are never stalled behind a long write lock.
+
+Exactly one runner should execute the cycle, chosen by LIFECYCLE_RUNNER: "api" runs
+it in a background thread of the API process, "celery" schedules it with Celery beat,
+and "off" disables it.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from database import (
+    get_statuses, delete_expired_analyses, fail_stale_analyses, incremental_vacuum, analyze_db,
+)
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "data"
+UPLOAD_PATTERN = re.compile(r"^financial_document_([0-9a-f-]{36})\.pdf$")
+
+# Where maintenance cycles run: api, celery or off
+LIFECYCLE_RUNNER = os.getenv("LIFECYCLE_RUNNER", "api").lower()
+# Days to keep finished analyses (0 disables expiry)
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30"))
+# Files younger than this are never treated as orphans (covers the gap between writing an upload and its row)
+ORPHAN_GRACE_MINUTES = int(os.getenv("ORPHAN_GRACE_MINUTES", "60"))
+# Tasks processing for longer than this are assumed abandoned
+STALE_TASK_HOURS = int(os.getenv("STALE_TASK_HOURS", "24"))
+# Tasks still pending after this long are assumed lost by the broker (keep it well above the longest queue wait)
+STALE_PENDING_HOURS = int(os.getenv("STALE_PENDING_HOURS", "72"))
+LIFECYCLE_BATCH_SIZE = int(os.getenv("LIFECYCLE_BATCH_SIZE", "500"))
+LIFECYCLE_BATCH_PAUSE = float(os.getenv("LIFECYCLE_BATCH_PAUSE", "0.1"))
+LIFECYCLE_INTERVAL_SECONDS = int(os.getenv("LIFECYCLE_INTERVAL_SECONDS", "3600"))
+VACUUM_PAGES_PER_STEP = 200
+MAX_VACUUM_STEPS = 50
+
+
+def upload_path(task_id: str) -> str:
+    """Path of the uploaded PDF for a task (same naming as main.py)."""
+    return os.path.join(DATA_DIR, f"financial_document_{task_id}.pdf")
+
+
+def _remove_file(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logger.warning("Could not remove %s: %s", path, e)
+        return False
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def fail_stale_tasks() -> int:
+    """Mark abandoned tasks as failed. Returns the number updated.
+
+    Pending tasks get the longer STALE_PENDING_HOURS, since their message may just be
+    waiting behind a long queue. If it does arrive later, the worker skips the task
+    because its row has already failed.
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(hours=STALE_TASK_HOURS)
+    pending_cutoff = now - timedelta(hours=STALE_PENDING_HOURS)
+    total = 0
+    while True:
+        updated = fail_stale_analyses(cutoff, pending_cutoff, batch_size=LIFECYCLE_BATCH_SIZE)
+        total += len(updated)
+        if len(updated) < LIFECYCLE_BATCH_SIZE:
+            return total
+        time.sleep(LIFECYCLE_BATCH_PAUSE)
+
+
+def reconcile_uploads() -> int:
+    """Remove upload files with no live task behind them. Returns the number of files removed.
+
+    A file is an orphan once it is older than the grace period and its task is either
+    missing from the database or already completed/failed.
+    """
+    if not os.path.isdir(DATA_DIR):
+        return 0
+
+    grace_cutoff = time.time() - ORPHAN_GRACE_MINUTES * 60
+    candidates = {}
+    with os.scandir(DATA_DIR) as entries:
+        for entry in entries:
+            match = UPLOAD_PATTERN.match(entry.name)
+            if match and entry.is_file() and entry.stat().st_mtime < grace_cutoff:
+                candidates[match.group(1)] = entry.path
+
+    removed = 0
+    for task_ids in _batches(list(candidates), LIFECYCLE_BATCH_SIZE):
+        statuses = get_statuses(task_ids)
+        for task_id in task_ids:
+            status = statuses.get(task_id, (None, None))[0]
+            if status not in ("pending", "processing") and _remove_file(candidates[task_id]):
+                removed += 1
+        time.sleep(LIFECYCLE_BATCH_PAUSE)
+    return removed
+
+
+def expire_analyses() -> int:
+    """Delete finished analyses past the retention period, with their files. Returns rows deleted."""
+    if RETENTION_DAYS <= 0:
+        return 0
+
+    cutoff = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+    total = 0
+    while True:
+        deleted = delete_expired_analyses(cutoff, batch_size=LIFECYCLE_BATCH_SIZE)
+        for task_id in deleted:
+            _remove_file(upload_path(task_id))
+        total += len(deleted)
+        if len(deleted) < LIFECYCLE_BATCH_SIZE:
+            return total
+        time.sleep(LIFECYCLE_BATCH_PAUSE)
+
+
+def compact_database():
+    """Give free pages back to the filesystem in small steps, then refresh planner statistics."""
+    for _ in range(MAX_VACUUM_STEPS):
+        free_pages = incremental_vacuum(VACUUM_PAGES_PER_STEP)
+        if not free_pages:
+            break
+        time.sleep(LIFECYCLE_BATCH_PAUSE)
+    analyze_db()
+
+
+def run_lifecycle_cycle() -> dict:
+    """Run one full maintenance cycle and return what it did."""
+    summary = {
+        "stale_tasks_failed": fail_stale_tasks(),
+        "orphan_files_removed": reconcile_uploads(),
+        "analyses_expired": expire_analyses(),
+    }
+    compact_database()
+    logger.info("Storage lifecycle cycle finished: %s", summary)
+    return summary
+
+
+def _lifecycle_loop(stop_event: threading.Event):
+    while not stop_event.is_set():
+        try:
+            run_lifecycle_cycle()
+        except Exception:
+            logger.exception("Storage lifecycle cycle failed")
+        stop_event.wait(LIFECYCLE_INTERVAL_SECONDS)
+
+
+def start_lifecycle_manager() -> threading.Event:
+    """Run lifecycle cycles every LIFECYCLE_INTERVAL_SECONDS in a daemon thread.
+
+    Returns an event that stops the loop when set.
+    """
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_lifecycle_loop, args=(stop_event,), name="storage-lifecycle", daemon=True)
+    thread.start()
+    return stop_event
@@ -1,16 +1,33 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from contextlib import asynccontextmanager
 import os
+import json
 import uuid
 
 from crewai import Crew, Process
 from agents import financial_analyst, verifier, investment_advisor, risk_assessor
 from task import verification, analyze_financial_document, investment_analysis, risk_assessment
-from database import init_db, save_analysis, update_analysis, get_analysis, get_all_analyses
+from tools import get_page_count
+from crew_context import CrewContextManager, on_task_complete
+from lifecycle import LIFECYCLE_RUNNER, start_lifecycle_manager
+from database import (
+    init_db, save_analysis, update_analysis, get_analysis, get_all_analyses, estimate_wait_seconds,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the storage lifecycle manager (orphan cleanup, retention, VACUUM/ANALYZE) in the background."""
+    lifecycle_stop = start_lifecycle_manager() if LIFECYCLE_RUNNER == "api" else None
+    yield
+    if lifecycle_stop is not None:
+        lifecycle_stop.set()
+
 
 app = FastAPI(
     title="Financial Document Analyzer",
     description="AI-powered financial document analysis system using CrewAI agents",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Initialize database on startup
@@ -18,16 +35,24 @@ init_db()
 
 
 def run_crew(query: str, file_path: str = "data/TSLA-Q2-2025-Update.pdf"):
-    """Run the full financial analysis crew with all agents and tasks."""
+    """Run the full financial analysis crew with all agents and tasks.
+
+    Returns the crew result and the per-run token statistics from the CrewContextManager.
+    """
     financial_crew = Crew(
         agents=[verifier, financial_analyst, investment_advisor, risk_assessor],
         tasks=[verification, analyze_financial_document, investment_analysis, risk_assessment],
         process=Process.sequential,
+        task_callback=on_task_complete,
         verbose=True,
     )
 
-    result = financial_crew.kickoff({"query": query, "file_path": file_path})
-    return result
+    with CrewContextManager(
+        stage_names=["verification", "financial_analysis", "investment_analysis", "risk_assessment"]
+    ) as context:
+        result = financial_crew.kickoff({"query": query, "file_path": file_path})
+
+    return result, context.stats(token_usage=getattr(result, "token_usage", None))
 
 
 @app.get("/")
@@ -46,6 +71,18 @@ async def analyze_document_endpoint(
     file_id = str(uuid.uuid4())
     file_path = f"data/financial_document_{file_id}.pdf"
 
+    # Validate query
+    if not query or query.strip() == "":
+        query = "Analyze this financial document for investment insights"
+
+    # Record the run up front so the lifecycle manager never treats its upload as an orphan
+    save_analysis(
+        task_id=file_id,
+        filename=file.filename,
+        query=query,
+        status="processing"
+    )
+
     try:
         # Ensure data directory exists
         os.makedirs("data", exist_ok=True)
@@ -55,20 +92,15 @@ async def analyze_document_endpoint(
             content = await file.read()
             f.write(content)
 
-        # Validate query
-        if not query or query.strip() == "":
-            query = "Analyze this financial document for investment insights"
-
         # Process the financial document with all analysts
-        response = run_crew(query=query.strip(), file_path=file_path)
+        response, token_stats = run_crew(query=query.strip(), file_path=file_path)
 
         # Save result to database
-        save_analysis(
+        update_analysis(
             task_id=file_id,
-            filename=file.filename,
-            query=query,
             result=str(response),
-            status="completed"
+            status="completed",
+            token_stats=token_stats,
         )
 
         return {
@@ -76,18 +108,13 @@ async def analyze_document_endpoint(
             "task_id": file_id,
             "query": query,
             "analysis": str(response),
-            "file_processed": file.filename
+            "file_processed": file.filename,
+            "tokens_saved": token_stats["tokens_saved"],
         }
 
     except Exception as e:
         # Save failed analysis to database
-        save_analysis(
-            task_id=file_id,
-            filename=file.filename,
-            query=query,
-            status="failed",
-            error=str(e)
-        )
+        update_analysis(task_id=file_id, status="failed", error=str(e))
         raise HTTPException(status_code=500, detail=f"Error processing financial document: {str(e)}")
 
     finally:
@@ -102,9 +129,14 @@ async def analyze_document_endpoint(
 @app.post("/analyze/async")
 async def analyze_document_async_endpoint(
     file: UploadFile = File(...),
-    query: str = Form(default="Analyze this financial document for investment insights")
+    query: str = Form(default="Analyze this financial document for investment insights"),
+    bulk: bool = Form(default=False),
 ):
-    """Queue a financial document for async analysis using Celery."""
+    """Queue a financial document for async analysis using Celery.
+
+    Documents are routed by page count: small ones to the interactive queue, large
+    ones (or any request with bulk=true, e.g. backfills) to the bulk queue.
+    """
 
     file_id = str(uuid.uuid4())
     file_path = f"data/financial_document_{file_id}.pdf"
@@ -122,30 +154,50 @@ async def analyze_document_async_endpoint(
         if not query or query.strip() == "":
             query = "Analyze this financial document for investment insights"
 
+        # Route by document size
+        from celery_worker import analyze_document_async, route_for_document
+        page_count = get_page_count(file_path)
+        queue, priority = route_for_document(page_count, bulk=bulk)
+
         # Save initial record to database
         save_analysis(
             task_id=file_id,
             filename=file.filename,
             query=query,
-            status="pending"
+            status="pending",
+            page_count=page_count,
+            queue=queue,
+            priority=priority,
         )
 
         # Queue the analysis task
-        from celery_worker import analyze_document_async
-        analyze_document_async.delay(
-            task_id=file_id,
-            query=query.strip(),
-            file_path=file_path,
-            filename=file.filename
+        analyze_document_async.apply_async(
+            kwargs={
+                "task_id": file_id,
+                "query": query.strip(),
+                "file_path": file_path,
+                "filename": file.filename,
+            },
+            queue=queue,
+            priority=priority,
         )
 
         return {
             "status": "queued",
             "task_id": file_id,
+            "queue": queue,
+            "page_count": page_count,
             "message": "Document analysis has been queued. Use /status/{task_id} to check progress.",
         }
 
     except Exception as e:
+        # Nothing will process this upload (e.g. the broker is down), so don't leave it behind
+        update_analysis(task_id=file_id, status="failed", error=str(e))
+        if os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+            except Exception:
+                pass
         raise HTTPException(status_code=500, detail=f"Error queuing document analysis: {str(e)}")
 
 
@@ -164,6 +216,14 @@ async def get_task_status(task_id: str):
         "created_at": str(analysis.created_at),
     }
 
+    if analysis.status in ("pending", "processing"):
+        from celery_worker import QUEUE_CONCURRENCY
+        response["queue"] = analysis.queue
+        response["page_count"] = analysis.page_count
+        response["estimated_wait_seconds"] = estimate_wait_seconds(
+            analysis, concurrency=QUEUE_CONCURRENCY.get(analysis.queue, 1)
+        )
+
     if analysis.status == "completed":
         response["result"] = analysis.result
         response["completed_at"] = str(analysis.completed_at)
@@ -208,6 +268,8 @@ async def get_result(task_id: str):
         "status": analysis.status,
         "result": analysis.result,
         "error": analysis.error,
+        "tokens_saved": analysis.tokens_saved,
+        "token_stats": json.loads(analysis.token_stats) if analysis.token_stats else None,
         "created_at": str(analysis.created_at),
         "completed_at": str(analysis.completed_at) if analysis.completed_at else None,
     }
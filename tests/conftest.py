@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime
+
+import pytest
+
+# Point the database module at a throwaway SQLite file before anything imports it
+_db_dir = tempfile.mkdtemp(prefix="financial_analyzer_test_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db():
+    """Fresh analysis_results table for each test."""
+    import database
+
+    database.init_db()
+    session = database.SessionLocal()
+    session.query(database.AnalysisResult).delete()
+    session.commit()
+    session.close()
+    return database
+
+
+@pytest.fixture
+def add_analysis(db):
+    """Factory that inserts an analysis row with exactly the given timestamps; returns its task_id."""
+
+    def add(status="completed", task_id=None, queue="interactive", priority=None, page_count=None,
+            result=None, created_at=None, started_at=None, completed_at=None):
+        task_id = task_id or str(uuid.uuid4())
+        db.save_analysis(task_id=task_id, filename="f.pdf", query="q", status=status, result=result,
+                         page_count=page_count, queue=queue, priority=priority)
+        session = db.SessionLocal()
+        row = session.query(db.AnalysisResult).filter_by(task_id=task_id).one()
+        row.created_at = created_at or datetime.utcnow()
+        row.started_at = started_at
+        row.completed_at = completed_at
+        session.commit()
+        session.close()
+        return task_id
+
+    return add
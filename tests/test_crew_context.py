@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import crew_context
+from crew_context import CrewContextManager, CONTEXT_DIVIDER, count_tokens, summarize_output
+
+STAGES = ["verification", "financial_analysis", "investment_analysis", "risk_assessment"]
+
+
+def _report(lines=300):
+    body = [f"- Revenue segment {i}: ${i * 125}M, up {i % 17}% YoY" for i in range(lines)]
+    prose = ["This paragraph restates the analysis in general terms without any figures."] * 20
+    return "\n".join(["# Financial Analysis"] + prose + body)
+
+
+def _output(text):
+    return SimpleNamespace(raw=text, agent="Analyst", description="Analyze the document")
+
+
+def test_short_output_is_left_unchanged():
+    assert summarize_output("# Summary\n- EPS: $0.33", 100) == "# Summary\n- EPS: $0.33"
+
+
+def test_summary_fits_budget_and_keeps_headings_and_figures():
+    summary = summarize_output(_report(), 200, label="analysis")
+    assert count_tokens(summary) <= 200
+    assert summary.startswith("[Compact summary of analysis output]")
+    assert "# Financial Analysis" in summary
+    assert "Revenue segment 0: $0M" in summary
+    assert "without any figures" not in summary
+
+
+def test_summary_respects_tiny_budget():
+    assert count_tokens(summarize_output(_report(), 3)) <= 3
+
+
+def test_context_for_last_stage_stays_within_budget():
+    outputs = [_output(_report()) for _ in STAGES]
+    with CrewContextManager(STAGES, token_budget=1500) as context:
+        for output in outputs:
+            crew_context.on_task_complete(output)
+            received = CONTEXT_DIVIDER.join(o.raw for o in outputs[:outputs.index(output) + 1])
+            if output is not outputs[-1]:
+                assert count_tokens(received) <= 1500
+
+    last = context.stats()["stages"][-1]
+    assert 0 < last["context_tokens"] <= 1500
+    assert context.stats()["tokens_saved"] > 0
+
+
+def test_full_outputs_are_restored_after_the_run():
+    full = _report()
+    outputs = [_output(full) for _ in STAGES]
+    with CrewContextManager(STAGES, token_budget=400):
+        for output in outputs:
+            crew_context.on_task_complete(output)
+        assert outputs[0].raw != full
+    assert all(output.raw == full for output in outputs)
+
+
+def test_repeat_document_reads_within_a_stage_are_not_resent():
+    document = "Revenue 100\n" * 500
+    with CrewContextManager(STAGES) as context:
+        assert context.deliver_document("doc.pdf", document) == document
+        assert context.deliver_document("doc.pdf", document) != document
+        crew_context.on_task_complete(_output("done"))
+        # A new stage starts a fresh agent conversation, so it gets the text again
+        assert context.cached_document("doc.pdf") == document
+        assert context.deliver_document("doc.pdf", document) == document
+
+    first = context.stats()["stages"][0]
+    assert first["document_tokens_avoided"] == first["document_tokens"] == count_tokens(document)
+
+
+def test_callback_is_a_no_op_without_an_active_run():
+    output = _output(_report())
+    crew_context.on_task_complete(output)
+    assert output.raw == _report()
+    assert crew_context.get_active_context() is None
+
+
+def test_stats_record_estimate_and_measured_usage():
+    with CrewContextManager(STAGES) as context:
+        context.deliver_document("doc.pdf", "Revenue 100\n" * 50)
+        for _ in STAGES:
+            crew_context.on_task_complete(_output(_report(20)))
+
+    stats = context.stats(token_usage=SimpleNamespace(prompt_tokens=12345, completion_tokens=678))
+    assert stats["estimated_context_tokens"] > 0
+    assert "prompt_tokens" not in stats
+    assert stats["measured_prompt_tokens"] == 12345
+    assert stats["measured_completion_tokens"] == 678
+    assert "measured_prompt_tokens" not in context.stats()
@@ -0,0 +1,103 @@
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import lifecycle
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(lifecycle, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(lifecycle, "LIFECYCLE_BATCH_PAUSE", 0)
+    monkeypatch.setattr(lifecycle, "LIFECYCLE_BATCH_SIZE", 2)
+    return tmp_path
+
+
+def _upload(task_id, age_minutes=120):
+    path = lifecycle.upload_path(task_id)
+    with open(path, "wb") as f:
+        f.write(b"%PDF")
+    old = time.time() - age_minutes * 60
+    os.utime(path, (old, old))
+    return path
+
+
+def test_incremental_vacuum_frees_a_full_step(db):
+    for _ in range(300):
+        db.save_analysis(task_id=str(uuid.uuid4()), filename="f.pdf", query="q", result="x" * 4000)
+    session = db.SessionLocal()
+    session.query(db.AnalysisResult).delete()
+    session.commit()
+    session.close()
+
+    with db.engine.connect() as conn:
+        free_before = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    assert free_before > 100
+
+    assert db.incremental_vacuum(50) == free_before - 50
+    assert db.incremental_vacuum(free_before) == 0
+
+
+def test_stale_tasks(data_dir, db, add_analysis):
+    now = datetime.utcnow()
+    past_processing_cutoff = now - timedelta(hours=lifecycle.STALE_TASK_HOURS + 1)
+    past_pending_cutoff = now - timedelta(hours=lifecycle.STALE_PENDING_HOURS + 1)
+    waiting_backfill = add_analysis("pending", created_at=past_processing_cutoff, queue="bulk")
+    lost_message = add_analysis("pending", created_at=past_pending_cutoff, queue="bulk")
+    crashed_worker = add_analysis("processing", created_at=past_processing_cutoff, started_at=past_processing_cutoff)
+    just_started = add_analysis("processing", created_at=past_processing_cutoff, started_at=now)
+    # Processing rows written before started_at existed are judged by created_at
+    legacy_processing = add_analysis("processing", created_at=past_processing_cutoff, started_at=None)
+
+    assert lifecycle.fail_stale_tasks() == 3
+    assert db.get_analysis(waiting_backfill).status == "pending"
+    assert db.get_analysis(lost_message).status == "failed"
+    assert db.get_analysis(crashed_worker).status == "failed"
+    assert db.get_analysis(just_started).status == "processing"
+    assert db.get_analysis(legacy_processing).status == "failed"
+
+
+def test_analyze_with_limit_refreshes_statistics(db, add_analysis):
+    for _ in range(5):
+        add_analysis()
+    db.analyze_db(analysis_limit=100)
+    with db.engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM sqlite_stat1").scalar() > 0
+
+
+def test_reconcile_removes_only_orphans(data_dir, db, add_analysis):
+    finished = _upload(add_analysis("completed"))
+    unknown = _upload(str(uuid.uuid4()))
+    queued = _upload(add_analysis("pending"))
+    running = _upload(add_analysis("processing", started_at=datetime.utcnow()))
+    fresh = _upload(str(uuid.uuid4()), age_minutes=0)
+    sample = data_dir / "TSLA-Q2-2025-Update.pdf"
+    sample.write_bytes(b"%PDF")
+
+    assert lifecycle.reconcile_uploads() == 2
+    assert not os.path.exists(finished) and not os.path.exists(unknown)
+    assert all(os.path.exists(p) for p in (queued, running, fresh, sample))
+
+
+def test_expire_deletes_old_finished_rows_in_batches(data_dir, db, add_analysis):
+    old = datetime.utcnow() - timedelta(days=lifecycle.RETENTION_DAYS + 1)
+    expired = [add_analysis(status, created_at=old) for status in ("completed", "failed", "completed")]
+    leftover = _upload(expired[0])
+    kept_recent = add_analysis("completed")
+    kept_pending = add_analysis("pending", created_at=old)
+
+    assert lifecycle.expire_analyses() == 3
+    assert all(db.get_analysis(task_id) is None for task_id in expired)
+    assert not os.path.exists(leftover)
+    assert db.get_analysis(kept_recent) and db.get_analysis(kept_pending)
+
+
+def test_worker_skips_abandoned_tasks(db, add_analysis):
+    worker = pytest.importorskip("celery_worker")
+    task_id = add_analysis("failed")
+    result = worker.analyze_document_async(task_id=task_id, query="q", file_path="missing.pdf", filename="f.pdf")
+    assert result["status"] == "skipped"
+    assert db.get_analysis(task_id).status == "failed"
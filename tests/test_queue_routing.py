@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+INTERACTIVE_QUEUE = "interactive"
+BULK_QUEUE = "bulk"
+
+
+@pytest.fixture
+def worker():
+    return pytest.importorskip("celery_worker")
+
+
+def test_small_documents_go_to_interactive_queue(worker):
+    queue, priority = worker.route_for_document(2)
+    assert queue == worker.INTERACTIVE_QUEUE
+    assert priority < worker.route_for_document(worker.BULK_PAGE_THRESHOLD)[1]
+
+
+def test_large_documents_go_to_bulk_queue(worker):
+    assert worker.route_for_document(worker.BULK_PAGE_THRESHOLD + 1)[0] == worker.BULK_QUEUE
+    assert worker.route_for_document(400) == (worker.BULK_QUEUE, worker.MAX_PRIORITY)
+
+
+def test_backfills_run_last_in_bulk_queue(worker):
+    assert worker.route_for_document(2, bulk=True) == (worker.BULK_QUEUE, worker.MAX_PRIORITY)
+
+
+def test_unreadable_pdf_is_not_treated_as_small(worker):
+    assert worker.route_for_document(0) == (worker.BULK_QUEUE, worker.DEFAULT_PRIORITY)
+
+
+def test_seconds_per_task_uses_completed_history(add_analysis, db):
+    now = datetime.utcnow()
+    assert db.get_seconds_per_task(INTERACTIVE_QUEUE) is None
+    add_analysis(queue=BULK_QUEUE, page_count=400, started_at=now - timedelta(seconds=300), completed_at=now)
+    # No interactive history yet: fall back to any queue
+    assert db.get_seconds_per_task(INTERACTIVE_QUEUE) == pytest.approx(300.0)
+
+    add_analysis(page_count=2, started_at=now - timedelta(seconds=100), completed_at=now)
+    add_analysis(page_count=30, started_at=now - timedelta(seconds=140), completed_at=now)
+    assert db.get_seconds_per_task(INTERACTIVE_QUEUE) == pytest.approx(120.0)
+    assert db.get_seconds_per_task(BULK_QUEUE) == pytest.approx(300.0)
+
+
+def test_wait_estimate_respects_priorities(add_analysis, db):
+    now = datetime.utcnow()
+    add_analysis(created_at=now - timedelta(hours=1), started_at=now - timedelta(seconds=10),
+                 completed_at=now)  # 10 seconds per task
+    add_analysis("pending", priority=3, page_count=5, created_at=now - timedelta(minutes=3))
+    add_analysis("pending", priority=9, page_count=100, created_at=now - timedelta(minutes=2))  # backfill, after us
+    add_analysis("processing", priority=9, page_count=7, created_at=now - timedelta(minutes=4),
+                 started_at=now)  # already on a worker
+    me = add_analysis("pending", priority=3, page_count=4, created_at=now - timedelta(minutes=1))
+    add_analysis("pending", priority=0, page_count=2, created_at=now)  # jumps ahead of us
+    add_analysis("pending", priority=3, page_count=50, created_at=now)
+    add_analysis("pending", queue=BULK_QUEUE, priority=0, page_count=80, created_at=now - timedelta(minutes=5))
+
+    analysis = db.get_analysis(me)
+    # Three tasks ahead (earlier same priority, running, later higher priority) plus our own run
+    assert db.estimate_wait_seconds(analysis, concurrency=1) == 3 * 10 + 10
+    assert db.estimate_wait_seconds(analysis, concurrency=2) == 15 + 10
+
+
+def test_wait_estimate_for_running_task_subtracts_elapsed(add_analysis, db):
+    now = datetime.utcnow()
+    add_analysis(started_at=now - timedelta(seconds=100), completed_at=now)
+    running = add_analysis("processing", priority=3, started_at=now - timedelta(seconds=40))
+    assert db.estimate_wait_seconds(db.get_analysis(running)) == 60
+
+
+def test_wait_estimate_needs_history(add_analysis, db):
+    me = add_analysis("pending", priority=3, page_count=4)
+    assert db.estimate_wait_seconds(db.get_analysis(me)) is None
+
+
+def test_backlog_index_exists(db):
+    from sqlalchemy import inspect
+
+    indexes = {ix["name"]: ix["column_names"] for ix in inspect(db.engine).get_indexes("analysis_results")}
+    assert indexes["ix_analysis_results_queue_status_created"] == ["queue", "status", "created_at"]
@@ -6,6 +6,8 @@ load_dotenv()
 from crewai.tools import tool
 import requests
 
+from crew_context import get_active_context
+
 ## Creating search tool using Serper API
 @tool("Search the Internet")
 def search_tool(search_query: str) -> str:
@@ -40,6 +42,16 @@ def search_tool(search_query: str) -> str:
     except Exception as e:
         return f"Search error: {str(e)}"
 
+## Helper for size-aware queue routing
+def get_page_count(file_path: str) -> int:
+    """Return the number of pages in a PDF, or 0 if it cannot be parsed."""
+    from pypdf import PdfReader
+
+    try:
+        return len(PdfReader(file_path).pages)
+    except Exception:
+        return 0
+
 ## Creating custom pdf reader tool
 @tool("Financial Document Reader")
 def read_data_tool(file_path: str = 'data/TSLA-Q2-2025-Update.pdf') -> str:
@@ -52,6 +64,11 @@ def read_data_tool(file_path: str = 'data/TSLA-Q2-2025-Update.pdf') -> str:
     if not file_path:
         file_path = 'data/TSLA-Q2-2025-Update.pdf'
 
+    # Reuse text already extracted during this crew run and skip re-sending it within a task
+    context = get_active_context()
+    if context is not None and context.cached_document(file_path) is not None:
+        return context.deliver_document(file_path, context.cached_document(file_path))
+
     reader = PdfReader(file_path)
     full_report = ""
 
@@ -69,9 +86,16 @@ def read_data_tool(file_path: str = 'data/TSLA-Q2-2025-Update.pdf') -> str:
     if len(full_report) > MAX_CHARS:
         full_report = full_report[:MAX_CHARS] + "\n\n[... Document truncated for token limit. Key financial data shown above ...]"
 
+    if context is not None:
+        return context.deliver_document(file_path, full_report)
     return full_report
 
 
+# CrewAI's shared tool cache would hand the full text back to every agent without calling
+# the tool; while a CrewContextManager is active it tracks document reads itself instead.
+read_data_tool.cache_function = lambda _args=None, _result=None: get_active_context() is None
+
+
 ## Creating Investment Analysis Tool
 @tool("Investment Analysis Tool")
 def analyze_investment_tool(financial_document_data: str) -> str: